@@ -3,30 +3,41 @@
 ### Author: Jeremy B. Kimball
 ### Date: 2022-03-04
 
+import argparse
+
 import numpy as np
+import matplotlib
+
+parser = argparse.ArgumentParser(description="Control a cart pole system with fuzzy logic.")
+parser.add_argument("--interactive", action="store_true",
+                    help="Open the pygame render window for the simulation and show the fuzzy set and results plots. "
+                         "By default the simulation runs without rendering and only the results plot is saved to "
+                         "fuzzy_cartpole_results.png")
+args = parser.parse_args()
+if not args.interactive:
+    matplotlib.use("Agg") # Skip the GUI backend entirely
+
 import matplotlib.pyplot as plt
 import gymnasium as gym
 from cartpole_continuous_action import ContinuousActionCartPoleEnv
 from fuzzylogic import plot_fuzzy_sets, ZShapeFuzzySet, FuzzyRule, FuzzySystem, ConstantFuzzySet
 
+DEBUG = False # Print the controller inputs and output at every step
+
 # Define fuzzy sets
 
 theta_set_neg = ZShapeFuzzySet(-0.01, 0.01, name="theta_neg", input_num=0)
 theta_set_pos = ZShapeFuzzySet(-0.01, 0.01, inverted=True, name="theta_pos", input_num=0)
-plot_fuzzy_sets([theta_set_neg, theta_set_pos], x_min=-0.5, x_max=0.5, title="Angle fuzzy set (radians)")
 
 theta_dot_set_neg = ZShapeFuzzySet(-0.5, 0.5, name="theta_dot_neg", input_num=1)
 theta_dot_set_pos = ZShapeFuzzySet(-0.5, 0.5, inverted=True, name="theta_dot_pos", input_num=1)
-plot_fuzzy_sets([theta_dot_set_neg, theta_dot_set_pos], -10, 10, title="Angular velocity fuzzy set (radians/s)")
 
 position_setpoint = 0 # Set the cart position setpoint desired location to the center of the track
 cart_pos_set_neg = ZShapeFuzzySet(-0.3+position_setpoint, 0.3+position_setpoint, name="cart_position_neg", input_num=2)
 cart_pos_set_pos = ZShapeFuzzySet(-0.3+position_setpoint, 0.3+position_setpoint, inverted=True, name="cart_position_pos", input_num=2)
-plot_fuzzy_sets([cart_pos_set_neg, cart_pos_set_pos], -2, 2, title="Cart position fuzzy set (meters)")
 
 cart_vel_set_neg = ZShapeFuzzySet(-0.5, 0.5, name="cart_velocity_neg", input_num=3)
 cart_vel_set_pos = ZShapeFuzzySet(-0.5, 0.5, inverted=True, name="cart_velocity_pos", input_num=3)
-plot_fuzzy_sets([cart_vel_set_neg, cart_vel_set_pos], -2, 2, title="Cart velocity fuzzy set (meters/s)")
 
 force_set_med_left = ConstantFuzzySet(-1.25, name="force_med_left")
 force_set_med_right = ConstantFuzzySet(1.25, name="force_med_right")
@@ -34,8 +45,16 @@ force_set_large_left = ConstantFuzzySet(-2.5, name="force_large_left")
 force_set_large_right = ConstantFuzzySet(2.5, name="force_large_right")
 force_set_small_left = ConstantFuzzySet(-0.6, name="force_small_left")
 force_set_small_right = ConstantFuzzySet(0.6, name="force_small_right")
-plot_fuzzy_sets([force_set_med_left, force_set_med_right, force_set_large_left, force_set_large_right, force_set_small_left, force_set_small_right], -4, 4, 
-                title="Force fuzzy set (N)", n_points=1000, POI = [-1.25, 1.25, -2.5, 2.5, -0.6, 0.6])
+
+# Plot the fuzzy sets (only shown in interactive mode)
+
+if args.interactive:
+  plot_fuzzy_sets([theta_set_neg, theta_set_pos], x_min=-0.5, x_max=0.5, title="Angle fuzzy set (radians)")
+  plot_fuzzy_sets([theta_dot_set_neg, theta_dot_set_pos], -10, 10, title="Angular velocity fuzzy set (radians/s)")
+  plot_fuzzy_sets([cart_pos_set_neg, cart_pos_set_pos], -2, 2, title="Cart position fuzzy set (meters)")
+  plot_fuzzy_sets([cart_vel_set_neg, cart_vel_set_pos], -2, 2, title="Cart velocity fuzzy set (meters/s)")
+  plot_fuzzy_sets([force_set_med_left, force_set_med_right, force_set_large_left, force_set_large_right, force_set_small_left, force_set_small_right], -4, 4, 
+                  title="Force fuzzy set (N)", n_points=1000, POI = [-1.25, 1.25, -2.5, 2.5, -0.6, 0.6])
 
 # Define fuzzy rules
 
@@ -66,19 +85,22 @@ system = FuzzySystem(rules)
 
 # Use fuzzy system to control cart pole
 
-env = ContinuousActionCartPoleEnv(render_mode="human")
+env = ContinuousActionCartPoleEnv(render_mode="human" if args.interactive else None)
 observation = env.reset(seed = 9)
 
-F = np.float32(0)
+F = 0.0
 
-applied_forces = []
-angles = []
-angular_velocities = []
-positions = []
-positions_setpoint = []
-times = []
+n_steps = 6000
+dt = 0.02 # Simulation time step (s)
 
-for i in range(6000):
+applied_forces = np.empty(n_steps)
+angles = np.empty(n_steps)
+angular_velocities = np.empty(n_steps)
+positions = np.empty(n_steps)
+positions_setpoint = np.empty(n_steps)
+times = np.arange(n_steps) * dt
+
+for i in range(n_steps):
 
   observation, reward, terminated, truncated, info = env.step(F)
 
@@ -86,16 +108,16 @@ for i in range(6000):
 
   if i < 1800:
     cart_position = observation[0] - 1
-    positions_setpoint.append(1)
-    positions.append(cart_position + 1)
+    positions_setpoint[i] = 1
+    positions[i] = cart_position + 1
   elif i < 3600:
     cart_position = observation[0] + 1
-    positions_setpoint.append(-1)
-    positions.append(cart_position - 1)
+    positions_setpoint[i] = -1
+    positions[i] = cart_position - 1
   else:
     cart_position = observation[0]
-    positions_setpoint.append(0)
-    positions.append(cart_position)
+    positions_setpoint[i] = 0
+    positions[i] = cart_position
 
   velocity = observation[1]
   angle = observation[2]
@@ -103,23 +125,18 @@ for i in range(6000):
 
   F = system.output([angle, angular_velocity, cart_position, velocity])
 
-  print("angle: ", angle)
-  print("angular_velocity: ", angular_velocity)
-  print("cart_position: ", cart_position)
-  print("velocity: ", velocity)
-  print("F: ", F)
-
-  F = np.float32(F)
+  if DEBUG:
+    print("angle: ", angle)
+    print("angular_velocity: ", angular_velocity)
+    print("cart_position: ", cart_position)
+    print("velocity: ", velocity)
+    print("F: ", F)
 
-  if F > 0:
-    F = np.float32(1)
-  elif F <= 0:
-    F = np.float32(-1)
+  F = 1.0 if F > 0 else -1.0
 
-  applied_forces.append(F)
-  angles.append(angle)
-  angular_velocities.append(angular_velocity)
-  times.append(i*0.02)
+  applied_forces[i] = F
+  angles[i] = angle
+  angular_velocities[i] = angular_velocity
 
   if terminated or truncated:
     observation = env.reset()
@@ -143,4 +160,7 @@ ax[3].set_title("Applied force")
 ax[3].set_xlabel("Time (s)")
 ax[3].set_ylabel("Force (N)")
 plt.tight_layout()
-plt.show()
\ No newline at end of file
+if args.interactive:
+  plt.show()
+else:
+  fig.savefig("fuzzy_cartpole_results.png")
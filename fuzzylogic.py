@@ -16,9 +16,34 @@
 ### The following functions are also included:
 ### - plot_fuzzy_sets
 
+import math
+from collections import OrderedDict
+from operator import mul
+
 import numpy as np
 import matplotlib.pyplot as plt
 
+def _input_membership(fuzzy_set):
+    ''' Get the function that calculates the membership of a fuzzy set for the full input vector x.
+    Sets bound to an input variable (e.g. ZShapeFuzzySet) and compound sets (AndFuzzySet, OrFuzzySet) index x
+    themselves, all others are passed x unchanged.
+    '''
+    return getattr(fuzzy_set, 'membership_indexed', fuzzy_set.membership)
+
+def _input_nums(fuzzy_set):
+    ''' Get the input variable numbers used by a fuzzy set and the sets it is built from '''
+    if isinstance(fuzzy_set, (AndFuzzySet, OrFuzzySet)):
+        return _input_nums(fuzzy_set.set1) | _input_nums(fuzzy_set.set2)
+    elif hasattr(fuzzy_set, 'input_num'):
+        return {fuzzy_set.input_num}
+    else:
+        return set()
+
+def _float_literal(value):
+    ''' Python source for a float, spelling out inf and nan since they have no literal '''
+    value = float(value)
+    return repr(value) if math.isfinite(value) else f"float('{value!r}')"
+
 def plot_fuzzy_sets(fuzzy_sets, x_min, x_max, n_points=100, title=None, POI=None):
     ''' Plot the membership functions of the fuzzy sets
     Parameters
@@ -35,20 +60,32 @@ def plot_fuzzy_sets(fuzzy_sets, x_min, x_max, n_points=100, title=None, POI=None
         Title of the plot, by default None
     POI : float, optional
         Point of interest, by default None
+
+    Returns
+    -------
+    matplotlib.figure.Figure
+        Figure containing the plot. It is not shown, so the caller decides when to call plt.show().
     '''
+    fig, ax = plt.subplots()
     x = np.linspace(x_min, x_max, n_points, endpoint=True)
     if POI:
         x = np.sort(np.append(x, POI))
         
     for fuzzy_set in fuzzy_sets:
-        y = [fuzzy_set.membership(xi) for xi in x]
-        plt.plot(x, y, label=fuzzy_set.name)
-    plt.legend()
-    plt.xlabel('Input')
-    plt.ylabel('Membership')
+        xs, ys = fuzzy_set.knots() if hasattr(fuzzy_set, 'knots') else (None, None)
+        # Piecewise linear sets are evaluated on the whole grid at once. Repeated breakpoints (e.g. a shoulder
+        # with a == b) are vertical edges that np.interp cannot reproduce, so those sets are evaluated point by point
+        if xs is not None and np.all(np.diff(xs) > 0):
+            y = np.interp(x, xs, ys, left=ys[0], right=ys[-1])
+        else:
+            y = [fuzzy_set.membership(xi) for xi in x]
+        ax.plot(x, y, label=fuzzy_set.name)
+    ax.legend()
+    ax.set_xlabel('Input')
+    ax.set_ylabel('Membership')
     if title:
-        plt.title(title)
-    plt.show()
+        ax.set_title(title)
+    return fig
 
 class ConstantFuzzySet:
     ''' Constant fuzzy set
@@ -64,6 +101,8 @@ class ConstantFuzzySet:
     membership(x)
         Calculate the membership of the fuzzy set for a given value of the input variable
     '''
+    __slots__ = ('name', 'value')
+
     def __init__(self, value, name=None):
         if not name:
             self.name = f'ConstantFuzzySet({value})'
@@ -95,7 +134,12 @@ class TriangularFuzzySet:
     -------
     membership(x)
         Calculate the membership of the fuzzy set for a given value of the input variable
+
+    knots()
+        Get the breakpoints of the piecewise linear membership function
     '''
+    __slots__ = ('name', 'a', 'b', 'c')
+
     def __init__(self, a, b, c, name=None):
         if not name:
             self.name = f'TriangularFuzzySet({a}, {b}, {c})'
@@ -115,6 +159,9 @@ class TriangularFuzzySet:
         else:
             return (self.c - x) / (self.c - self.b)
 
+    def knots(self):
+        return [self.a, self.b, self.c], [0, 1, 0]
+
 class TrapezoidalFuzzySet:
     ''' Trapezoidal fuzzy set
     Parameters
@@ -135,6 +182,9 @@ class TrapezoidalFuzzySet:
     membership(x)
         Calculate the membership of the fuzzy set for a given value of the input variable
 
+    knots()
+        Get the breakpoints of the piecewise linear membership function
+
     __and__(other)
         Calculate the intersection of two fuzzy sets
 
@@ -144,6 +194,8 @@ class TrapezoidalFuzzySet:
     midpoint()
         Calculate the midpoint of the fuzzy set
     '''
+    __slots__ = ('name', 'a', 'b', 'c', 'd')
+
     def __init__(self, a, b, c, d, name=None):
         if not name:
             self.name = f'TrapezoidalFuzzySet({a}, {b}, {c}, {d})'
@@ -163,6 +215,9 @@ class TrapezoidalFuzzySet:
             return (x - self.a) / (self.b - self.a)
         else:
             return (self.d - x) / (self.d - self.c)
+
+    def knots(self):
+        return [self.a, self.b, self.c, self.d], [0, 1, 1, 0]
         
     def __and__(self, other):
         a = max(self.a, other.a)
@@ -204,6 +259,12 @@ class ZShapeFuzzySet:
     membership(x)
         Calculate the membership of the fuzzy set for a given value of the input variable
 
+    membership_indexed(x)
+        Calculate the membership of the fuzzy set for a given input vector, using the input variable input_num
+
+    knots()
+        Get the breakpoints of the piecewise linear membership function
+
     __and__(other)  
         Calculate the intersection of two fuzzy sets
 
@@ -216,34 +277,67 @@ class ZShapeFuzzySet:
     area()  
         Calculate the area of the fuzzy set
     '''
+    __slots__ = ('name', '_a', '_b', 'inverted', 'input_num', '_inv_ba')
 
     def __init__(self, a, b, input_num=0, inverted=False, name=None):
         if not name:
             self.name = f'ZShapeFuzzySet({a}, {b}, inverted={inverted})'
         else:
             self.name = name
-        self.a = a
-        self.b = b
+        self._a = a
+        self._b = b
         self.inverted = inverted
         self.input_num = input_num
+        self._update_inv_ba()
+
+    @property
+    def a(self):
+        return self._a
+
+    @a.setter
+    def a(self, a):
+        self._a = a
+        self._update_inv_ba()
+
+    @property
+    def b(self):
+        return self._b
+
+    @b.setter
+    def b(self, b):
+        self._b = b
+        self._update_inv_ba()
+
+    def _update_inv_ba(self):
+        # Only used strictly between a and b, so a degenerate set never needs it
+        self._inv_ba = 1.0 / (self._b - self._a) if self._b != self._a else 0.0
         
     def membership(self, x):
         if isinstance(x, list):
             x = x[self.input_num]
+        if x <= self._a:
+            m = 0.0
+        elif x >= self._b:
+            m = 1.0
+        else:
+            m = (x - self._a) * self._inv_ba
+        return m if self.inverted else 1.0 - m
+
+    def membership_indexed(self, x):
+        x = x[self.input_num]
+        if x <= self._a:
+            m = 0.0
+        elif x >= self._b:
+            m = 1.0
+        else:
+            m = (x - self._a) * self._inv_ba
+        return m if self.inverted else 1.0 - m
+
+    def knots(self):
         if self.inverted:
-            if x <= self.a:
-                return 0
-            elif x >= self.b:
-                return 1
-            else:
-                return (x - self.a) / (self.b - self.a)
+            return [self.a, self.b], [0, 1]
         else:
-            if x <= self.a:
-                return 1
-            elif x >= self.b:
-                return 0
-            else:
-                return 1 - (x - self.a) / (self.b - self.a)
+            return [self.a, self.b], [1, 0]
     
     def __and__(self, other):
         return AndFuzzySet(self, other)
@@ -264,14 +358,28 @@ class AndFuzzySet:
     -------
     membership(x)
         Calculate the membership of the fuzzy set for a given value of the input variable
+
+    membership_indexed(x)
+        Calculate the membership of the fuzzy set for a given input vector, letting each set use its own input variable
     '''
+    __slots__ = ('set1', 'set2', 'name', '_membership1', '_membership2')
+
     def __init__(self, set1, set2):
         self.set1 = set1
         self.set2 = set2
         self.name = f'AndFuzzySet({set1.name}, {set2.name})'
+        self._membership1 = _input_membership(set1)
+        self._membership2 = _input_membership(set2)
         
     def membership(self, x):
-        return min(self.set1.membership(x), self.set2.membership(x))
+        m1 = self.set1.membership(x)
+        m2 = self.set2.membership(x)
+        return m1 if m1 < m2 else m2
+
+    def membership_indexed(self, x):
+        m1 = self._membership1(x)
+        m2 = self._membership2(x)
+        return m1 if m1 < m2 else m2
     
 class OrFuzzySet:
     ''' Fuzzy set that represents the union of two fuzzy sets
@@ -286,14 +394,28 @@ class OrFuzzySet:
     -------
     membership(x)
         Calculate the membership of the fuzzy set for a given value of the input variable
+
+    membership_indexed(x)
+        Calculate the membership of the fuzzy set for a given input vector, letting each set use its own input variable
     '''
+    __slots__ = ('set1', 'set2', 'name', '_membership1', '_membership2')
+
     def __init__(self, set1, set2):
         self.set1 = set1
         self.set2 = set2
         self.name = f'OrFuzzySet({set1.name}, {set2.name})'
+        self._membership1 = _input_membership(set1)
+        self._membership2 = _input_membership(set2)
         
     def membership(self, x):
-        return max(self.set1.membership(x), self.set2.membership(x))
+        m1 = self.set1.membership(x)
+        m2 = self.set2.membership(x)
+        return m1 if m1 > m2 else m2
+
+    def membership_indexed(self, x):
+        m1 = self._membership1(x)
+        m2 = self._membership2(x)
+        return m1 if m1 > m2 else m2
 
 class FuzzyRule:
     ''' Fuzzy rule
@@ -316,43 +438,218 @@ class FuzzyRule:
     def __init__(self, antecedent, consequent):
         self.antecedent = antecedent
         self.consequent = consequent
+        self._membership = _input_membership(antecedent)
 
     def evaluate(self, x):
-        return self.antecedent.membership(x)
+        return self._membership(x)
 
     def get_output(self, x=None):
         if x is None:
             return self.consequent.x_value()
         else:
-            return self.consequent.x_value(self.antecedent.membership(x))
+            return self.consequent.x_value(self._membership(x))
 
 class FuzzySystem:
     ''' Fuzzy system
     Parameters
     ----------
     rules : list of FuzzyRule
-        List of rules of the system
+        List of rules of the system. The rule bank is frozen at construction: the consequent outputs and the
+        coefficients of the antecedent sets are copied, so changes to the rules or their fuzzy sets afterwards
+        need a new FuzzySystem.
+    cache_size : int, optional
+        Maximum number of outputs kept in a least-recently-used cache keyed on the rounded input, by default 0 (no cache).
+        The cache is lossy and only allowed for rule banks that cannot be compiled, since the generated evaluator of a
+        compiled rule bank is faster than a cache lookup.
+    cache_decimals : int or list of int, optional
+        Number of decimals each input is rounded to when building the cache key, by default 3
 
     Methods
     -------
     output(x)
         Compute the crisp output of the system based on the input x. Uses Tsukamoto's method.
+
+    output_batch(X)
+        Compute the crisp outputs of the system for each row of the inputs X.
     '''
 
-    def __init__(self, rules):
+    def __init__(self, rules, cache_size=0, cache_decimals=3):
         self.rules = rules
+        self.cache_size = cache_size
+        if not isinstance(cache_decimals, int):
+            cache_decimals = tuple(cache_decimals)
+            n_inputs = 1 + max((i for rule in rules for i in _input_nums(rule.antecedent)), default=-1)
+            if len(cache_decimals) < n_inputs:
+                raise ValueError(f'cache_decimals has {len(cache_decimals)} entries but the rules use {n_inputs} inputs')
+        self.cache_decimals = cache_decimals
+        self._cache = OrderedDict()
+        # Consequents are constant, so their crisp outputs can be computed once
+        self._outputs = np.array([rule.get_output() for rule in rules], dtype=np.float64)
+        self._output_values = tuple(self._outputs.tolist())
+        # Bound once so the per-rule path skips the rule and method lookups on every call
+        self._eval_fns = tuple(_input_membership(rule.antecedent) for rule in rules)
+
+        # Pack the rule bank into coefficient arrays when possible so it can be evaluated with NumPy
+        compiled = self._compile(rules)
+        self._vectorized = compiled is not None
+        if self._vectorized:
+            self._idx, self._slope, self._offset = compiled
+            # Single inputs go through a function specialized to this rule bank
+            self._evaluate = self._codegen()
+            if cache_size:
+                raise ValueError('cache_size must be 0 for rule banks that compile to a generated evaluator, '
+                                 'which is faster than a cache lookup')
+
+    @staticmethod
+    def _compile(rules):
+        ''' Pack the antecedents of the rules into parallel coefficient arrays of shape (n_rules, 2)
+        Parameters
+        ----------
+        rules : list of FuzzyRule
+            List of rules of the system
+
+        Returns
+        -------
+        tuple of np.ndarray or None
+            Input indices, slopes and offsets of the antecedent sets, such that the membership of each set is
+            clip(x[idx] * slope + offset, 0, 1), or None if an antecedent is not a ZShapeFuzzySet or an AndFuzzySet
+            of two ZShapeFuzzySets. Rules with a single set are padded with a dummy set whose membership is always 1.
+        '''
+        leaves = []
+        for rule in rules:
+            antecedent = rule.antecedent
+            if isinstance(antecedent, ZShapeFuzzySet):
+                pair = (antecedent,)
+            elif isinstance(antecedent, AndFuzzySet):
+                pair = (antecedent.set1, antecedent.set2)
+            else:
+                return None
+            for leaf in pair:
+                if not isinstance(leaf, ZShapeFuzzySet) or leaf.b <= leaf.a:
+                    return None
+            leaves.append(pair)
+
+        n_rules = len(rules)
+        idx = np.zeros((n_rules, 2), dtype=np.intp)
+        slope = np.zeros((n_rules, 2))
+        offset = np.ones((n_rules, 2))
+        for k, pair in enumerate(leaves):
+            for j, leaf in enumerate(pair):
+                # S-shape: (x - a) / (b - a), Z-shape: 1 - (x - a) / (b - a)
+                idx[k, j] = leaf.input_num
+                if leaf.inverted:
+                    slope[k, j] = leaf._inv_ba
+                    offset[k, j] = -leaf.a * leaf._inv_ba
+                else:
+                    slope[k, j] = -leaf._inv_ba
+                    offset[k, j] = 1 + leaf.a * leaf._inv_ba
+        if not (np.all(np.isfinite(slope)) and np.all(np.isfinite(offset))):
+            # e.g. the reciprocal width of a very narrow set overflows, leave those to the per-rule path
+            return None
+        return idx, slope, offset
+
+    def _vectorized_strengths(self, x):
+        # x is a single input vector or a batch of them along the leading axes
+        m = np.asarray(x, dtype=np.float64)[..., self._idx] * self._slope
+        m += self._offset
+        np.clip(m, 0, 1, out=m)
+        return m.min(axis=-1)
+
+    def _codegen(self):
+        ''' Generate a function computing the output of the compiled rule bank with all its coefficients inlined
+        Returns
+        -------
+        function
+            Function of the input vector x returning the crisp output of the system
+        '''
+        lines = ['def output(x):']
+        for i in sorted(set(self._idx.ravel().tolist())):
+            lines.append(f'    x{i} = float(x[{i}])')
+
+        n_rules = len(self._idx)
+        for k in range(n_rules):
+            leaves = []
+            for j in range(self._idx.shape[1]):
+                slope = float(self._slope[k, j])
+                offset = float(self._offset[k, j])
+                if slope == 0 and offset == 1:
+                    continue # Dummy leaf, membership is always 1
+                m = f'm{k}_{j}'
+                lines.append(f'    {m} = x{self._idx[k, j]} * {_float_literal(slope)} + {_float_literal(offset)}')
+                lines.append(f'    {m} = 0.0 if {m} < 0.0 else 1.0 if {m} > 1.0 else {m}')
+                leaves.append(m)
+            if len(leaves) == 2:
+                lines.append(f'    s{k} = {leaves[0]} if {leaves[0]} < {leaves[1]} else {leaves[1]}')
+            else:
+                lines.append(f'    s{k} = {leaves[0]}')
+
+        denominator = ' + '.join(f's{k}' for k in range(n_rules)) or '0.0'
+        numerator = ' + '.join(f'{_float_literal(self._output_values[k])} * s{k}' for k in range(n_rules)) or '0.0'
+        lines.append(f'    denominator = {denominator}')
+        lines.append('    if denominator == 0:')
+        lines.append('        return 0.0')
+        lines.append(f'    return ({numerator}) / denominator')
+
+        namespace = {}
+        exec(compile('\n'.join(lines), f'<FuzzySystem output, {n_rules} rules>', 'exec'), namespace)
+        return namespace['output']
 
     def output(self, x):
-        # Evaluate strength of each rule based on input x
-        strengths = [rule.evaluate(x) for rule in self.rules]
-        
-        # Determine output strength of the system
-        output_strength = np.fmax.reduce(strengths)
-        
-        # Compute weighted average of midpoints of consequents of each rule
-        if output_strength == 0:
-            return 0
+        if not self.cache_size:
+            return self._evaluate(x)
+
+        # Inputs that round to the same key share an output, so slowly varying inputs skip rule evaluation
+        if isinstance(self.cache_decimals, int):
+            key = tuple(round(float(xi), self.cache_decimals) for xi in x)
+        else:
+            key = tuple(round(float(xi), decimals) for xi, decimals in zip(x, self.cache_decimals))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        y = self._evaluate(list(key))
+        self._cache[key] = y
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return y
+
+    def _evaluate(self, x):
+        # Per-rule path, compiled rule banks replace this with the function generated by _codegen.
+        # Evaluate strength of each rule based on input x, then compute the weighted average
+        # of the consequent outputs of each rule. Builtin reductions avoid NumPy's per-call
+        # overhead on a handful of rules
+        strengths = [fn(x) for fn in self._eval_fns]
+        numerator = sum(map(mul, self._output_values, strengths))
+        denominator = sum(strengths)
+
+        if denominator == 0:
+            return 0.0
         else:
-            numerator = np.sum([rule.get_output() for rule in self.rules] * np.array(strengths), axis=0)
-            denominator = np.sum(strengths)
-            return np.sum(numerator / denominator)
\ No newline at end of file
+            return float(numerator / denominator)
+
+    def output_batch(self, X):
+        ''' Compute the crisp outputs of the system for a batch of inputs. Agrees with calling output on each row up to
+        floating-point rounding: compiled rule banks are evaluated in one vectorized pass whose sums may be ordered
+        differently, and other rule banks go through output row by row, including its cache.
+        Parameters
+        ----------
+        X : array_like
+            Inputs of shape (n_samples, n_inputs), one input vector per row
+
+        Returns
+        -------
+        np.ndarray
+            Outputs of shape (n_samples,)
+        '''
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2:
+            raise ValueError(f'X must have shape (n_samples, n_inputs), got shape {X.shape}')
+        if not self._vectorized:
+            return np.array([self.output(x) for x in X], dtype=np.float64)
+
+        strengths = self._vectorized_strengths(X)
+        numerator = strengths @ self._outputs
+        denominator = strengths.sum(axis=1)
+        outputs = np.zeros_like(denominator)
+        np.divide(numerator, denominator, out=outputs, where=denominator != 0)
+        return outputs